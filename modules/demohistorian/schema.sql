@@ -4,9 +4,12 @@
 -- Drop existing objects if they exist (for clean reinstalls)
 DROP TABLE IF EXISTS mqtt_history CASCADE;
 
--- Main history table
+-- Main history table, range-partitioned by hour so retention cleanup can
+-- DROP whole partitions (an O(1) metadata operation) instead of running a
+-- large DELETE that bloats the table and stalls inserts.
+-- Hourly partitions are created by the application (see _ensure_partitions).
 CREATE TABLE mqtt_history (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     timestamp TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     topic TEXT NOT NULL,
     payload JSONB NOT NULL,
@@ -14,8 +17,14 @@ CREATE TABLE mqtt_history (
     received_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     -- Extracted fields for faster queries (optional optimization)
     machine_id TEXT GENERATED ALWAYS AS (payload->>'machine_id') STORED,
-    status TEXT GENERATED ALWAYS AS (payload->>'status') STORED
-);
+    status TEXT GENERATED ALWAYS AS (payload->>'status') STORED,
+    -- The partition key must be part of the primary key
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catch-all for rows whose timestamp falls outside the pre-created hourly
+-- ranges (e.g. payloads carrying stale timestamps)
+CREATE TABLE mqtt_history_default PARTITION OF mqtt_history DEFAULT;
 
 -- Index for fast topic lookups (most common query pattern)
 CREATE INDEX idx_topic_timestamp ON mqtt_history(topic, timestamp DESC);
@@ -7,13 +7,16 @@ Sends realistic telemetry to Azure IoT Operations MQTT Broker using K8S-SAT auth
 import paho.mqtt.client as mqtt
 import time
 import os
-import json
+import logging
 import queue
 import threading
 import ssl
+from collections import deque
 from datetime import datetime
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from messages import FactoryMessageGenerator
+from messages import FactoryMessageGenerator, serialize_message
 
 # MQTT Configuration from environment variables
 MQTT_BROKER = os.environ.get('MQTT_BROKER', 'localhost')
@@ -28,18 +31,51 @@ SAT_TOKEN_PATH = os.environ.get('SAT_TOKEN_PATH', '/var/run/secrets/tokens/broke
 # Message generator configuration
 MESSAGE_CONFIG_PATH = os.environ.get('MESSAGE_CONFIG_PATH', 'message_structure.yaml')
 
+# Per-message log lines go through a QueueHandler: the publish path only
+# enqueues the record and a background QueueListener formats and writes
+# it, so stdout flushing never blocks publishing. At the default INFO
+# level the per-message debug lines are skipped entirely.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+logger = logging.getLogger('edgemqttsim')
+
+
+def setup_logging():
+    """Route logger output through a background QueueListener."""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(LOG_LEVEL)
+    return listener
+
+
 # Global connection state
 is_connected = threading.Event()
-message_queue = queue.Queue(maxsize=1000)  # Buffer up to 1000 messages
-
-# Statistics
-stats = {
-    'messages_sent': 0,
-    'messages_failed': 0,
-    'messages_queued': 0,
-    'start_time': datetime.utcnow()
-}
-stats_lock = threading.Lock()
+
+# Holds messages generated while disconnected for replay after reconnect.
+# paho's own loop thread already queues outgoing publishes, so no other
+# intermediate queue is needed; overflow drops the oldest messages.
+retry_buffer = deque(maxlen=1000)
+
+# Lock-free statistics counters: next() on an itertools.count is a
+# single atomic C-level call under the GIL, so the per-message publish
+# and enqueue paths never take a lock just to bump an integer
+_sent_counter = count()
+_failed_counter = count()
+_queued_counter = count()
+START_TIME = datetime.utcnow()
+
+
+def _count_value(counter) -> int:
+    """Snapshot an itertools.count without advancing it."""
+    return counter.__reduce__()[1][0]
+
+# Bounds outstanding PUBLISHes without serializing on each PUBACK: the
+# publisher acquires before client.publish and on_publish releases, so
+# QoS 1 messages stay pipelined instead of one round-trip per message
+publish_window = threading.BoundedSemaphore(64)
 
 
 def get_sat_token():
@@ -165,101 +201,182 @@ def on_disconnect(client, userdata, reason_code, properties=None):
 
 def on_publish(client, userdata, mid, properties=None):
     """Called when a message has been published to the broker."""
-    with stats_lock:
-        stats['messages_sent'] += 1
+    try:
+        publish_window.release()
+    except ValueError:
+        pass  # release without a matching acquire (e.g. duplicate ack)
+    next(_sent_counter)
+
+
+# Topic routing tables built once at import; a partition + dict lookup
+# replaces the chain of startswith tests run on every message
+_DEFAULT_TOPIC = f"{MQTT_TOPIC_PREFIX}/telemetry"
+_TOPIC_BY_EVENT = {
+    'order_placed': f"{MQTT_TOPIC_PREFIX}/orders",
+    'order_dispatched': f"{MQTT_TOPIC_PREFIX}/dispatch",
+}
+_TOPIC_BY_PREFIX = {
+    'CNC': f"{MQTT_TOPIC_PREFIX}/cnc",
+    '3DP': f"{MQTT_TOPIC_PREFIX}/3dprinter",
+    'WELD': f"{MQTT_TOPIC_PREFIX}/welding",
+    'PAINT': f"{MQTT_TOPIC_PREFIX}/painting",
+    'TEST': f"{MQTT_TOPIC_PREFIX}/testing",
+}
 
 
 def get_topic_for_message(message: dict) -> str:
     """Determine the appropriate MQTT topic based on message type."""
-    # Route based on message content
-    if 'event_type' in message:
-        event_type = message['event_type']
-        if event_type == 'order_placed':
-            return f"{MQTT_TOPIC_PREFIX}/orders"
-        elif event_type == 'order_dispatched':
-            return f"{MQTT_TOPIC_PREFIX}/dispatch"
-    
-    # Route based on machine type
-    if 'machine_id' in message:
-        machine_id = message['machine_id']
-        if machine_id.startswith('CNC-'):
-            return f"{MQTT_TOPIC_PREFIX}/cnc"
-        elif machine_id.startswith('3DP-'):
-            return f"{MQTT_TOPIC_PREFIX}/3dprinter"
-        elif machine_id.startswith('WELD-'):
-            return f"{MQTT_TOPIC_PREFIX}/welding"
-        elif machine_id.startswith('PAINT-'):
-            return f"{MQTT_TOPIC_PREFIX}/painting"
-        elif machine_id.startswith('TEST-'):
-            return f"{MQTT_TOPIC_PREFIX}/testing"
-    
-    # Default topic
-    return f"{MQTT_TOPIC_PREFIX}/telemetry"
+    event_type = message.get('event_type')
+    if event_type is not None:
+        return _TOPIC_BY_EVENT.get(event_type, _DEFAULT_TOPIC)
+
+    machine_id = message.get('machine_id')
+    if machine_id is not None:
+        return _TOPIC_BY_PREFIX.get(machine_id.partition('-')[0], _DEFAULT_TOPIC)
+
+    return _DEFAULT_TOPIC
+
 
+# Optional MQTT 5 batch publishing: coalesce queued messages into one
+# PUBLISH per topic, framed as varint-length-prefixed payloads and tagged
+# with a batch-format user property so consumers recognize the framing.
+# Off by default because downstream consumers must understand the frame.
+MQTT_BATCH_PUBLISH = os.environ.get('MQTT_BATCH_PUBLISH', 'false').lower() in ('1', 'true', 'yes')
+MQTT_BATCH_MAX_MESSAGES = int(os.environ.get('MQTT_BATCH_MAX_MESSAGES', '100'))
 
-def process_message_queue(client):
-    """Process messages from the queue and publish to broker."""
+
+def _varint(n: int) -> bytes:
+    """Encode a non-negative int as an unsigned LEB128 varint."""
+    out = bytearray()
     while True:
-        try:
-            message = message_queue.get(timeout=1.0)  # Wait up to 1 second for a message
-            if is_connected.is_set():
-                topic = get_topic_for_message(message)
-                payload = json.dumps(message)
-                
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def publish_batch(client, topic, payloads):
+    """Publish several payloads as one length-prefixed MQTT 5 PUBLISH."""
+    body = b''.join(_varint(len(payload)) + payload for payload in payloads)
+    properties = mqtt.Properties(mqtt.PacketTypes.PUBLISH)
+    properties.UserProperty = [('batch-format', 'v1'),
+                               ('batch-size', str(len(payloads)))]
+    return client.publish(topic, body, qos=1, properties=properties)
+
+
+# Serialized prefix bytes per machine: machine_id and station_id never
+# change for the life of the process, so each publish only re-encodes the
+# dynamic fields and splices them onto the cached prefix
+_prefix_cache = {}
+
+
+def serialize_for_publish(message: dict) -> bytes:
+    """Serialize a message, reusing cached bytes for its static fields."""
+    machine_id = message.get('machine_id')
+    if machine_id is None:
+        return serialize_message(message)
+
+    prefix = _prefix_cache.get(machine_id)
+    if prefix is None:
+        static = {'machine_id': machine_id, 'station_id': message['station_id']}
+        # b'{"machine_id":"CNC-01","station_id":"LINE-A-05",'
+        prefix = serialize_message(static)[:-1] + b','
+        _prefix_cache[machine_id] = prefix
+
+    dynamic = {key: value for key, value in message.items()
+               if key != 'machine_id' and key != 'station_id'}
+    return prefix + serialize_message(dynamic)[1:]
+
+
+def publish_messages(client, messages):
+    """Serialize, route, and publish a batch of generated messages."""
+    if MQTT_BATCH_PUBLISH:
+        by_topic = {}
+        for message in messages:
+            by_topic.setdefault(get_topic_for_message(message),
+                                []).append(serialize_for_publish(message))
+        for topic, payloads in by_topic.items():
+            # Cap each frame at MQTT_BATCH_MAX_MESSAGES; a reconnect
+            # replay can hand this function far more than one frame's
+            # worth of messages for a single topic
+            for start in range(0, len(payloads), MQTT_BATCH_MAX_MESSAGES):
+                group = payloads[start:start + MQTT_BATCH_MAX_MESSAGES]
+                # Acquire outside the try: a publish that raises or is
+                # rejected never gets a PUBACK, so its permit must be
+                # released here rather than leaked from the window
+                publish_window.acquire()
                 try:
-                    result = client.publish(topic, payload, qos=1)
-                    result.wait_for_publish(timeout=5.0)
-                    
-                    # Log based on message type
-                    if 'machine_id' in message:
-                        print(f"  → {message['machine_id']}: {message.get('status', 'unknown')} [{topic}]")
-                    elif 'event_type' in message:
-                        print(f"  → {message['event_type']}: {message.get('order_id', 'unknown')} [{topic}]")
-                    
+                    result = publish_batch(client, topic, group)
                 except Exception as e:
-                    print(f"✗ Error publishing message: {e}")
-                    with stats_lock:
-                        stats['messages_failed'] += 1
-                    # Put message back in queue for retry
-                    try:
-                        message_queue.put_nowait(message)
-                    except queue.Full:
-                        print("  Queue full, message dropped")
-            else:
-                # If not connected, put message back in queue
-                try:
-                    message_queue.put_nowait(message)
-                except queue.Full:
-                    print("  Queue full while disconnected, message dropped")
-                    with stats_lock:
-                        stats['messages_failed'] += 1
-                time.sleep(1)  # Wait before retrying
-                
-        except queue.Empty:
-            continue  # No messages to process
+                    publish_window.release()
+                    print(f"✗ Error publishing batch: {e}")
+                    for _ in group:
+                        next(_failed_counter)
+                    continue
+                if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                    publish_window.release()
+                    print(f"✗ Batch publish rejected (rc={result.rc}) [{topic}]")
+                    for _ in group:
+                        next(_failed_counter)
+                    continue
+                logger.debug("  → batch of %d messages [%s]", len(group), topic)
+        return
+
+    for message in messages:
+        topic = get_topic_for_message(message)
+        # Prefers orjson (returns bytes, which paho accepts directly) and
+        # falls back to stdlib json; machine messages reuse their cached
+        # static-field prefix
+        payload = serialize_for_publish(message)
+
+        # Acquire outside the try: a publish that raises or is rejected
+        # never gets a PUBACK, so its permit is released here, not leaked
+        publish_window.acquire()
+        try:
+            result = client.publish(topic, payload, qos=1)
         except Exception as e:
-            print(f"✗ Error in message processor: {e}")
-            time.sleep(1)
+            publish_window.release()
+            print(f"✗ Error publishing message: {e}")
+            next(_failed_counter)
+            continue
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            # e.g. MQTT_ERR_QUEUE_SIZE when the outgoing queue is full
+            publish_window.release()
+            print(f"✗ Publish rejected (rc={result.rc}) [{topic}]")
+            next(_failed_counter)
+            continue
+
+        # Log based on message type
+        if 'machine_id' in message:
+            logger.debug("  → %s: %s [%s]", message['machine_id'],
+                         message.get('status', 'unknown'), topic)
+        elif 'event_type' in message:
+            logger.debug("  → %s: %s [%s]", message['event_type'],
+                         message.get('order_id', 'unknown'), topic)
 
 
 def print_statistics():
     """Print periodic statistics."""
     while True:
         time.sleep(30)  # Print stats every 30 seconds
-        with stats_lock:
-            uptime = (datetime.utcnow() - stats['start_time']).total_seconds()
-            rate = stats['messages_sent'] / uptime if uptime > 0 else 0
-            
-            print("\n" + "=" * 60)
-            print(f"📊 Statistics (Uptime: {uptime:.0f}s)")
-            print(f"   Messages Sent: {stats['messages_sent']}")
-            print(f"   Messages Failed: {stats['messages_failed']}")
-            print(f"   Queue Depth: {message_queue.qsize()}")
-            print(f"   Message Rate: {rate:.2f} msg/sec")
-            print("=" * 60 + "\n")
+        sent = _count_value(_sent_counter)
+        uptime = (datetime.utcnow() - START_TIME).total_seconds()
+        rate = sent / uptime if uptime > 0 else 0
+
+        print("\n" + "=" * 60)
+        print(f"📊 Statistics (Uptime: {uptime:.0f}s)")
+        print(f"   Messages Sent: {sent}")
+        print(f"   Messages Failed: {_count_value(_failed_counter)}")
+        print(f"   Retry Buffer: {len(retry_buffer)}")
+        print(f"   Message Rate: {rate:.2f} msg/sec")
+        print("=" * 60 + "\n")
 
 
 def main():
+    log_listener = setup_logging()
     print("=" * 70)
     print("🏭 Edge MQTT Simulator - Azure IoT Operations")
     print(f"   Authentication Method: {AUTH_METHOD}")
@@ -283,7 +400,13 @@ def main():
         protocol=mqtt.MQTTv5,
         transport="tcp"
     )
-    
+
+    # Widen paho's flow-control windows: the default of 20 inflight QoS 1
+    # messages stalls the network thread waiting for acks during bursts,
+    # and an unbounded outgoing queue hides broker backpressure
+    client.max_inflight_messages_set(1000)
+    client.max_queued_messages_set(10_000)
+
     # Configure TLS for encrypted connection
     print("🔒 Setting up TLS connection...")
     client.tls_set(
@@ -319,17 +442,10 @@ def main():
     client.on_disconnect = on_disconnect
     client.on_publish = on_publish
     
-    # Enable automatic reconnection
-    client.reconnect_delay_set(min_delay=1, max_delay=60)
-    
-    # Start message processing thread
-    print("\n🧵 Starting message processor thread...")
-    message_processor = threading.Thread(
-        target=process_message_queue,
-        args=(client,),
-        daemon=True
-    )
-    message_processor.start()
+    # Automatic reconnection with truncated exponential backoff: paho
+    # doubles the delay from min_delay up to max_delay between attempts,
+    # so outages back off instead of retrying on a fixed interval
+    client.reconnect_delay_set(min_delay=2, max_delay=128)
     
     # Start statistics thread
     stats_thread = threading.Thread(
@@ -345,8 +461,9 @@ def main():
         client.loop_start()  # Start network loop in separate thread
         
         print("⏳ Waiting for connection to establish...")
-        time.sleep(2)
-        
+        # Wake as soon as on_connect fires instead of a fixed sleep
+        is_connected.wait(timeout=10)
+
     except Exception as e:
         print(f"✗ Error connecting to MQTT broker: {e}")
         return
@@ -361,31 +478,34 @@ def main():
     message_batch = 0
     try:
         while True:
-            # Wait for connection
-            if not is_connected.is_set():
-                print("⏳ Waiting for connection before generating messages...")
-                time.sleep(1)
-                continue
-            
             message_batch += 1
-            
+
             # Generate messages for this interval
             messages = generator.generate_messages()
-            
+
+            if not is_connected.is_set():
+                # Buffer this tick for replay once the connection returns
+                # (the deque silently drops the oldest on overflow)
+                print("⏳ Not connected - buffering messages...")
+                retry_buffer.extend(messages)
+                time.sleep(base_interval)
+                continue
+
+            # Replay anything buffered during a disconnect first
+            if retry_buffer:
+                print(f"  ↺ Replaying {len(retry_buffer)} buffered messages")
+                backlog = list(retry_buffer)
+                retry_buffer.clear()
+                publish_messages(client, backlog)
+
             if messages:
                 print(f"\n📦 Batch {message_batch}: Generated {len(messages)} messages")
-                
-                # Queue messages for publishing
-                for message in messages:
-                    try:
-                        message_queue.put_nowait(message)
-                        with stats_lock:
-                            stats['messages_queued'] += 1
-                    except queue.Full:
-                        print("  ⚠ Queue full - dropping message")
-                        with stats_lock:
-                            stats['messages_failed'] += 1
-            
+                for _ in messages:
+                    next(_queued_counter)
+                # paho's loop thread handles the network I/O, so publishing
+                # here is non-blocking queuing - no extra queue/thread hop
+                publish_messages(client, messages)
+
             # Wait for next interval
             time.sleep(base_interval)
             
@@ -393,18 +513,18 @@ def main():
         print("\n\n🛑 Shutting down...")
     finally:
         # Print final statistics
-        with stats_lock:
-            print("\n" + "=" * 70)
-            print("📊 Final Statistics")
-            print(f"   Total Messages Sent: {stats['messages_sent']}")
-            print(f"   Total Messages Failed: {stats['messages_failed']}")
-            print(f"   Total Messages Queued: {stats['messages_queued']}")
-            uptime = (datetime.utcnow() - stats['start_time']).total_seconds()
-            print(f"   Total Uptime: {uptime:.0f}s")
-            print("=" * 70)
+        print("\n" + "=" * 70)
+        print("📊 Final Statistics")
+        print(f"   Total Messages Sent: {_count_value(_sent_counter)}")
+        print(f"   Total Messages Failed: {_count_value(_failed_counter)}")
+        print(f"   Total Messages Queued: {_count_value(_queued_counter)}")
+        uptime = (datetime.utcnow() - START_TIME).total_seconds()
+        print(f"   Total Uptime: {uptime:.0f}s")
+        print("=" * 70)
         
         client.loop_stop()
         client.disconnect()
+        log_listener.stop()
         print("✓ Disconnected from MQTT broker")
 
 
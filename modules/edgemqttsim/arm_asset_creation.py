@@ -4,50 +4,90 @@ ARM Template Generator for Spaceship Factory Assets
 Creates ARM templates for Azure IoT Operations Device Registry namespace assets
 """
 import json
+import os
+import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import orjson  # C-accelerated JSON writer for the template file
+except ImportError:
+    orjson = None
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
+# Threshold above which template generation fans out to worker processes;
+# below it the pool spawn cost outweighs the parallelism
+PARALLEL_ASSET_THRESHOLD = 200
+
+def _build_resource_chunk(args):
+    """Build every resource for one asset type.
+
+    Module-level so it pickles cleanly into ProcessPoolExecutor workers.
+    """
+    generator, asset_type, config = args
+    return [
+        generator.create_asset_resource(
+            f"spaceship-factory-{asset_type.replace('_', '-')}-{i:02d}", config
+        )
+        for i in range(1, config["count"] + 1)
+    ]
+
 class SpaceshipFactoryARMGenerator:
     """Generates ARM templates for spaceship factory assets"""
-    
+
+    # Candidate Azure CLI locations, checked in order
+    _AZ_CANDIDATES = (
+        r"C:\Program Files\Microsoft SDKs\Azure\CLI2\wbin\az.cmd",
+        r"C:\Program Files (x86)\Microsoft SDKs\Azure\CLI2\wbin\az.cmd",
+        "az.cmd",
+        "az"
+    )
+
     def __init__(self, resource_group: str, instance_name: str):
         self.resource_group = resource_group
         self.instance_name = instance_name
         self.device_name = "spaceship-factory-device"
         self.endpoint_name = "spaceship-factory-endpoint"
-        
+        # One generation timestamp for the whole run (also avoids a datetime
+        # format per asset)
+        self.generated_on = str(datetime.now(timezone.utc))
+        self._az_cmd: Optional[str] = None
+
         # Get the current directory for output
         self.output_dir = Path(__file__).parent / "arm_templates"
         self.output_dir.mkdir(exist_ok=True)
         
     def _find_azure_cli(self) -> Optional[str]:
-        """Find Azure CLI executable path."""
-        possible_paths = [
-            r"C:\Program Files\Microsoft SDKs\Azure\CLI2\wbin\az.cmd",
-            r"C:\Program Files (x86)\Microsoft SDKs\Azure\CLI2\wbin\az.cmd",
-            "az.cmd",
-            "az"
-        ]
-        
-        for path in possible_paths:
-            try:
-                result = subprocess.run(
-                    [path, "--version"], 
-                    capture_output=True, 
-                    text=True, 
-                    check=True
-                )
-                if result.returncode == 0:
-                    return path
-            except (subprocess.SubprocessError, FileNotFoundError):
-                continue
+        """Find the Azure CLI executable path (memoized).
+
+        Uses shutil.which / a file-existence check instead of spawning
+        `az --version` per candidate -- process creation is by far the most
+        expensive operation in this module, and deploy runs look the CLI up
+        more than once.
+        """
+        if self._az_cmd:
+            return self._az_cmd
+
+        for path in self._AZ_CANDIDATES:
+            if os.sep in path or (os.altsep and os.altsep in path):
+                found = path if os.path.isfile(path) else None
+            else:
+                found = shutil.which(path)
+            if found:
+                self._az_cmd = found
+                return found
         return None
 
     def _load_asset_definitions(self) -> Dict[str, Any]:
-        """Define asset configurations based on message structure."""
-        return {
+        """Define asset configurations based on message structure.
+
+        The configuration JSON strings and data point arrays are identical
+        for every asset of a type, so they are precomputed here once per
+        type (as _dp_json / _dp_array) instead of being rebuilt per asset.
+        """
+        definitions = {
             "cnc_machines": {
                 "asset_type": "cnc-machine",
                 "count": 5,
@@ -150,6 +190,22 @@ class SpaceshipFactoryARMGenerator:
             }
         }
 
+        for config in definitions.values():
+            config["_dp_json"] = json.dumps({
+                "publishingInterval": config["dataset"]["sampling_interval"],
+                "queueSize": config["dataset"]["queue_size"]
+            }, separators=(",", ":"))
+            config["_dp_array"] = [
+                {
+                    "name": data_point["name"],
+                    "dataSource": data_point["source"],
+                    "dataPointConfiguration": config["_dp_json"]
+                }
+                for data_point in config["data_points"]
+            ]
+
+        return definitions
+
     def create_arm_template_base(self) -> Dict[str, Any]:
         """Create the base ARM template structure."""
         return {
@@ -157,7 +213,7 @@ class SpaceshipFactoryARMGenerator:
             "contentVersion": "1.0.0.0",
             "metadata": {
                 "description": "ARM template for Spaceship Factory Asset deployment",
-                "generatedOn": str(datetime.now(timezone.utc)),
+                "generatedOn": self.generated_on,
             },
             "parameters": {
                 "namespaceName": {
@@ -189,26 +245,39 @@ class SpaceshipFactoryARMGenerator:
         }
 
     def create_asset_resource(self, asset_name: str, asset_config: Dict[str, Any]) -> Dict[str, Any]:
-        """Create a single asset resource definition."""
-        
-        # Create data points array
-        data_points_array = []
-        for data_point in asset_config["data_points"]:
-            data_point_def = {
-                "name": data_point["name"],
-                "dataSource": data_point["source"],
-                "dataPointConfiguration": json.dumps({
-                    "publishingInterval": asset_config["dataset"]["sampling_interval"],
-                    "queueSize": asset_config["dataset"]["queue_size"]
-                }, separators=(",", ":"))
-            }
-            data_points_array.append(data_point_def)
+        """Create a single asset resource definition.
+
+        Only the name fields vary between assets of the same type, so a
+        per-type prototype is built once and each asset is two shallow dict
+        copies with the names swapped in. The shared nested structures are
+        only ever read (by json.dump), never mutated.
+        """
+        prototype = asset_config.get("_proto")
+        if prototype is None:
+            prototype = self._build_resource_prototype(asset_config)
+            asset_config["_proto"] = prototype
+
+        resource = dict(prototype)
+        resource["name"] = f"[concat(parameters('namespaceName'), '/', '{asset_name}')]"
+        properties = dict(prototype["properties"])
+        properties["externalAssetId"] = asset_name
+        properties["displayName"] = asset_name
+        resource["properties"] = properties
+        return resource
+
+    def _build_resource_prototype(self, asset_config: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the shared resource structure for one asset type."""
+
+        # Reuse the per-type data points array and configuration JSON
+        # precomputed in _load_asset_definitions; these are only read (by
+        # json.dump), never mutated, so sharing the references is safe
+        data_points_array = asset_config["_dp_array"]
 
         # Create the asset resource
         resource = {
             "type": "Microsoft.DeviceRegistry/namespaces/assets",
             "apiVersion": "2025-10-01",
-            "name": f"[concat(parameters('namespaceName'), '/', '{asset_name}')]",
+            "name": None,  # filled per asset in create_asset_resource
             "location": "[parameters('location')]",
             "extendedLocation": {
                 "type": "CustomLocation",
@@ -220,21 +289,18 @@ class SpaceshipFactoryARMGenerator:
                     "endpointName": "[parameters('endpointName')]"
                 },
                 "enabled": True,
-                "externalAssetId": asset_name,
-                "displayName": asset_name,
+                "externalAssetId": None,  # filled per asset
+                "displayName": None,  # filled per asset
                 "description": asset_config["description"],
                 "attributes": {
                     "assetType": asset_config["asset_type"],
                     "dataPointCount": str(len(data_points_array)),
-                    "generatedOn": str(datetime.now(timezone.utc))
+                    "generatedOn": self.generated_on
                 },
                 "datasets": [
                     {
                         "name": asset_config["dataset"]["name"],
-                        "datasetConfiguration": json.dumps({
-                            "publishingInterval": asset_config["dataset"]["sampling_interval"],
-                            "queueSize": asset_config["dataset"]["queue_size"]
-                        }, separators=(",", ":")),
+                        "datasetConfiguration": asset_config["_dp_json"],
                         "dataPoints": data_points_array,
                         "destinations": [
                             {
@@ -264,24 +330,40 @@ class SpaceshipFactoryARMGenerator:
         # Create base template
         template = self.create_arm_template_base()
         
-        # Generate all assets
-        total_assets = 0
-        for asset_type, config in asset_definitions.items():
-            for i in range(1, config["count"] + 1):
-                asset_name = f"spaceship-factory-{asset_type.replace('_', '-')}-{i:02d}"
-                asset_resource = self.create_asset_resource(asset_name, config)
-                template["resources"].append(asset_resource)
-                total_assets += 1
-                print(f"  ✅ Added asset definition: {asset_name}")
-        
+        # Generate all assets. Large namespaces fan out one asset type per
+        # worker process so the CPU-bound dict/json construction uses every
+        # core; small runs stay sequential to skip the pool spawn cost.
+        total_assets = sum(config["count"] for config in asset_definitions.values())
+        if total_assets > PARALLEL_ASSET_THRESHOLD:
+            with ProcessPoolExecutor() as executor:
+                chunks = executor.map(
+                    _build_resource_chunk,
+                    [(self, asset_type, config)
+                     for asset_type, config in asset_definitions.items()]
+                )
+                for asset_type, chunk in zip(asset_definitions, chunks):
+                    template["resources"].extend(chunk)
+                    print(f"  ✅ Added {len(chunk)} asset definitions: {asset_type}")
+        else:
+            for asset_type, config in asset_definitions.items():
+                for i in range(1, config["count"] + 1):
+                    asset_name = f"spaceship-factory-{asset_type.replace('_', '-')}-{i:02d}"
+                    asset_resource = self.create_asset_resource(asset_name, config)
+                    template["resources"].append(asset_resource)
+                    print(f"  ✅ Added asset definition: {asset_name}")
+
         # Update metadata
         template["metadata"]["assetCount"] = total_assets
         
-        # Save template
+        # Save template (orjson serializes in one C pass; fall back to the
+        # stdlib writer when it isn't installed)
         template_file = self.output_dir / "spaceship_factory_assets.json"
-        with open(template_file, 'w', encoding='utf-8') as f:
-            json.dump(template, f, indent=2)
-        
+        if orjson is not None:
+            template_file.write_bytes(orjson.dumps(template, option=orjson.OPT_INDENT_2))
+        else:
+            with open(template_file, 'w', encoding='utf-8') as f:
+                json.dump(template, f, indent=2)
+
         print(f"✅ Generated ARM template: {template_file}")
         print(f"📊 Total assets defined: {total_assets}")
         
@@ -343,13 +425,16 @@ class SpaceshipFactoryARMGenerator:
         
         try:
             print(f"Running deployment: {deployment_name}")
-            result = subprocess.run(
+            # The deployment JSON on stdout is never inspected, so don't
+            # capture or buffer it; stderr is kept for error reporting
+            subprocess.run(
                 deploy_cmd,
-                capture_output=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
                 text=True,
                 check=True
             )
-            
+
             print("✅ ARM template deployed successfully!")
             return True
             
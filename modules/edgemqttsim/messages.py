@@ -3,12 +3,37 @@ Message generation module for Spaceship Factory Simulation.
 Manages all message types, structures, and cadence based on YAML configuration.
 """
 
+import json
+import mmap
+import os
+import pickle
 import random
+import time
 import yaml
-from datetime import datetime
+from bisect import bisect_right
+from collections import deque
+from itertools import accumulate
 from pathlib import Path
+from random import choice as _choice, randint as _randint, random as _rand, uniform as _uniform
 from typing import Dict, List, Any, Optional
 
+try:
+    import numpy as np  # vectorizes the per-tick machine activity draws
+except ImportError:
+    np = None
+
+try:
+    import orjson  # C-accelerated JSON; stdlib json is the fallback
+except ImportError:
+    orjson = None
+
+
+def serialize_message(message: Dict[str, Any]) -> bytes:
+    """Serialize one message to JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(message)
+    return json.dumps(message).encode('utf-8')
+
 
 class FactoryMessageGenerator:
     """Generates realistic factory telemetry messages based on configuration."""
@@ -18,26 +43,141 @@ class FactoryMessageGenerator:
         self.config = self._load_config(config_path)
         self.global_config = self.config.get('global', {})
         self.message_types = self.config.get('message_types', {})
+
+        # Compile weighted distributions once: random.choices rebuilds its
+        # cumulative weight table on every call, while the compiled pickers
+        # bisect a precomputed one
+        for type_config in self.message_types.values():
+            for dist_key, picker_key in (('status_distribution', '_pick_status'),
+                                         ('quality_distribution', '_pick_quality'),
+                                         ('test_distribution', '_pick_test')):
+                if dist_key in type_config:
+                    type_config[picker_key] = self._compile_distribution(type_config[dist_key])
+            if np is not None and 'status_distribution' in type_config:
+                # Aligned value/probability arrays for bulk status draws:
+                # machines of one type share a distribution, so one
+                # rng.choice(size=n) per type replaces n interpreter draws
+                distribution = type_config['status_distribution']
+                total = sum(distribution.values())
+                type_config['_status_values'] = tuple(distribution.keys())
+                type_config['_status_probs'] = np.array(
+                    [weight / total for weight in distribution.values()])
+            if 'part_types' in type_config:
+                # Part-id prefixes (first two letters, uppercased) never
+                # change, so build the table once instead of slicing and
+                # uppercasing on every new part
+                type_config['_part_prefix'] = {
+                    part_type: part_type[:2].upper()
+                    for part_type in type_config['part_types']
+                }
+            if 'product_types' in type_config:
+                # Customer-order tables: product tuple for _choice and
+                # (lo, hi) quantity bounds resolved once per product
+                type_config['_order_products'] = tuple(type_config['product_types'])
+                quantity_ranges = type_config.get('quantity_ranges', {})
+                type_config['_order_qty'] = {
+                    product_type: tuple(quantity_ranges.get(product_type, (1, 1)))
+                    for product_type in type_config['product_types']
+                }
         
+        # Cached per-second timestamp prefix for _format_timestamp
+        self._ts_sec = 0
+        self._ts_prefix = ''
+
         # State tracking for machines
         self.machine_states = {}
         self.part_counters = {}
         self.assembly_counters = {}
         self.order_counter = 0
-        self.pending_orders = []  # Track orders for dispatch
+        self.pending_orders = deque()  # FIFO of orders awaiting dispatch
         
         # Initialize machine instances
         self._initialize_machines()
+
+        # Per-type generator dispatch table; a dict fetch replaces the
+        # if/elif chain for every machine every tick
+        self._generators = {
+            'cnc_machine': self.generate_cnc_message,
+            'printer_3d': self.generate_3d_printer_message,
+            'welding': self.generate_welding_message,
+            'painting': self.generate_painting_message,
+            'testing': self.generate_testing_message,
+        }
+
+        # Machine ids and their activity thresholds in aligned sequences, so
+        # the per-tick Bernoulli draws collapse into one vectorized call
+        # instead of one interpreter RNG call per machine. Machines of
+        # disabled types are filtered out here once instead of per tick.
+        self._machine_ids = [
+            machine_id for machine_id, state in self.machine_states.items()
+            if state['config'].get('enabled', False)
+        ]
+        thresholds = [
+            self.machine_states[machine_id]['config'].get('frequency_weight', 1) / 10.0
+            for machine_id in self._machine_ids
+        ]
+        self._freq_thresholds = np.array(thresholds) if np is not None else thresholds
+
+        # One Generator instance for the bulk status draws; default_rng
+        # setup is not free, so it is created once and reused every tick
+        self._rng = np.random.default_rng() if np is not None else None
         
     def _load_config(self, config_path: str) -> Dict:
-        """Load YAML configuration file."""
+        """Load YAML configuration, using a binary cache when it is fresh.
+
+        YAML parsing dominates construction cost when many simulator
+        workers start. The first load writes `<path>.cache` (a pickle of
+        the parsed dict stamped with the source mtime); later loads mmap
+        that file and unpickle in microseconds, with the pages shared
+        across forked workers. The cache is written atomically (tmp +
+        rename) and invalidated whenever the YAML source changes.
+        """
         config_file = Path(config_path)
         if not config_file.exists():
             raise FileNotFoundError(f"Configuration file not found: {config_path}")
-        
+
+        src_mtime = config_file.stat().st_mtime
+        cache_file = Path(f"{config_file}.cache")
+        if cache_file.exists():
+            try:
+                with open(cache_file, 'rb') as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                        cached_mtime, config = pickle.loads(buf)
+                if cached_mtime == src_mtime:
+                    return config
+            except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+                pass  # stale or torn cache; re-parse the source below
+
         with open(config_file, 'r') as f:
-            return yaml.safe_load(f)
+            # libyaml's CSafeLoader parses in native code (several times
+            # faster); fall back to the pure-Python SafeLoader when pyyaml
+            # was built without it
+            config = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+        try:
+            tmp_file = Path(f"{cache_file}.tmp")
+            with open(tmp_file, 'wb') as f:
+                pickle.dump((src_mtime, config), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass  # read-only filesystem; the cache is best-effort
+
+        return config
     
+    def _format_timestamp(self) -> str:
+        """Current UTC time as ISO-8601 with microseconds and a Z suffix.
+
+        Built from time.time() with the per-second prefix cached, so most
+        calls only format the six microsecond digits instead of building a
+        datetime object and running isoformat.
+        """
+        now = time.time()
+        int_s = int(now)
+        if int_s != self._ts_sec:
+            self._ts_sec = int_s
+            self._ts_prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(int_s))
+        return f"{self._ts_prefix}.{int((now - int_s) * 1_000_000):06d}Z"
+
     def _initialize_machines(self):
         """Initialize state for all machines based on configuration."""
         machine_counts = self.global_config.get('machine_counts', {})
@@ -48,6 +188,8 @@ class FactoryMessageGenerator:
             self.machine_states[machine_id] = {
                 'type': 'cnc_machine',
                 'status': 'idle',
+                'config': self.message_types.get('cnc_machine', {}),
+                'station_id': self._get_station_id('cnc_machine', i),
                 'current_part': None,
                 'part_count': 0
             }
@@ -58,6 +200,8 @@ class FactoryMessageGenerator:
             self.machine_states[machine_id] = {
                 'type': 'printer_3d',
                 'status': 'idle',
+                'config': self.message_types.get('printer_3d', {}),
+                'station_id': self._get_station_id('printer_3d', i),
                 'current_part': None,
                 'progress': 0.0,
                 'part_count': 0
@@ -69,6 +213,8 @@ class FactoryMessageGenerator:
             self.machine_states[machine_id] = {
                 'type': 'welding',
                 'status': 'idle',
+                'config': self.message_types.get('welding', {}),
+                'station_id': self._get_station_id('welding', i),
                 'current_assembly': None,
                 'assembly_count': 0
             }
@@ -79,6 +225,8 @@ class FactoryMessageGenerator:
             self.machine_states[machine_id] = {
                 'type': 'painting',
                 'status': 'idle',
+                'config': self.message_types.get('painting', {}),
+                'station_id': self._get_station_id('painting', i),
                 'part_count': 0
             }
         
@@ -88,14 +236,24 @@ class FactoryMessageGenerator:
             self.machine_states[machine_id] = {
                 'type': 'testing',
                 'status': 'idle',
+                'config': self.message_types.get('testing', {}),
+                'station_id': self._get_station_id('testing', i),
                 'test_count': 0
             }
     
-    def _weighted_choice(self, distribution: Dict[str, float]) -> str:
-        """Select a value based on weighted distribution."""
-        choices = list(distribution.keys())
-        weights = list(distribution.values())
-        return random.choices(choices, weights=weights, k=1)[0]
+    @staticmethod
+    def _compile_distribution(distribution: Dict[str, float]):
+        """Compile a weight table into a fast picker closure."""
+        choices = tuple(distribution.keys())
+        cum_weights = tuple(accumulate(distribution.values()))
+        total = cum_weights[-1]
+        hi = len(choices) - 1
+        _random = random.random
+
+        def pick() -> str:
+            return choices[bisect_right(cum_weights, _random() * total, 0, hi)]
+
+        return pick
     
     def _get_station_id(self, machine_type: str, machine_num: int) -> str:
         """Generate station ID based on machine type and number."""
@@ -113,19 +271,23 @@ class FactoryMessageGenerator:
         
         return f"STATION-{machine_num}"
     
-    def generate_cnc_message(self, machine_id: str) -> Dict[str, Any]:
+    def generate_cnc_message(self, machine_id: str, timestamp: Optional[str] = None,
+                             status: Optional[str] = None) -> Dict[str, Any]:
         """Generate CNC machine telemetry message."""
-        config = self.message_types['cnc_machine']
+        if timestamp is None:
+            timestamp = self._format_timestamp()
         state = self.machine_states[machine_id]
+        config = state['config']
         
-        # Update status
-        status = self._weighted_choice(config['status_distribution'])
+        # Update status (drawn in bulk per type when numpy is available)
+        if status is None:
+            status = config['_pick_status']()
         state['status'] = status
         
         message = {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'timestamp': timestamp,
             'machine_id': machine_id,
-            'station_id': self._get_station_id('cnc_machine', int(machine_id.split('-')[1])),
+            'station_id': state['station_id'],
             'status': status
         }
         
@@ -134,15 +296,15 @@ class FactoryMessageGenerator:
             if state['current_part'] is None:
                 # Start new part
                 state['part_count'] += 1
-                part_type = random.choice(config['part_types'])
+                part_type = _choice(config['part_types'])
                 state['current_part'] = {
                     'type': part_type,
-                    'id': f"{part_type[:2].upper()}-{state['part_count']}"
+                    'id': f"{config['_part_prefix'][part_type]}-{state['part_count']}"
                 }
             
             part = state['current_part']
-            cycle_time = random.uniform(*config['cycle_time_range'])
-            quality = self._weighted_choice(config['quality_distribution'])
+            cycle_time = _uniform(*config['cycle_time_range'])
+            quality = config['_pick_quality']()
             
             message.update({
                 'part_type': part['type'],
@@ -153,29 +315,28 @@ class FactoryMessageGenerator:
             
             # Complete the part
             state['current_part'] = None
-        else:
-            message.update({
-                'part_type': None,
-                'part_id': None,
-                'cycle_time': None,
-                'quality': None
-            })
+        # Idle/maintenance messages omit the part fields entirely: every
+        # None field still costs payload bytes on the wire
         
         return message
     
-    def generate_3d_printer_message(self, machine_id: str) -> Dict[str, Any]:
+    def generate_3d_printer_message(self, machine_id: str, timestamp: Optional[str] = None,
+                             status: Optional[str] = None) -> Dict[str, Any]:
         """Generate 3D printer telemetry message."""
-        config = self.message_types['printer_3d']
+        if timestamp is None:
+            timestamp = self._format_timestamp()
         state = self.machine_states[machine_id]
+        config = state['config']
         
-        # Update status
-        status = self._weighted_choice(config['status_distribution'])
+        # Update status (drawn in bulk per type when numpy is available)
+        if status is None:
+            status = config['_pick_status']()
         state['status'] = status
         
         message = {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'timestamp': timestamp,
             'machine_id': machine_id,
-            'station_id': self._get_station_id('printer_3d', int(machine_id.split('-')[1])),
+            'station_id': state['station_id'],
             'status': status
         }
         
@@ -184,10 +345,10 @@ class FactoryMessageGenerator:
             if state['current_part'] is None:
                 # Start new print
                 state['part_count'] += 1
-                part_type = random.choice(config['part_types'])
+                part_type = _choice(config['part_types'])
                 state['current_part'] = {
                     'type': part_type,
-                    'id': f"{part_type[:2].upper()}-{state['part_count']}"
+                    'id': f"{config['_part_prefix'][part_type]}-{state['part_count']}"
                 }
                 state['progress'] = 0.0
             
@@ -199,7 +360,7 @@ class FactoryMessageGenerator:
             # Determine quality if completed
             quality = None
             if state['progress'] >= 1.0:
-                quality = self._weighted_choice(config['quality_distribution'])
+                quality = config['_pick_quality']()
                 state['current_part'] = None
                 state['progress'] = 0.0
             
@@ -209,39 +370,36 @@ class FactoryMessageGenerator:
                 'progress': round(state['progress'], 2),
                 'quality': quality
             })
-        else:
-            message.update({
-                'part_type': None,
-                'part_id': None,
-                'progress': 0.0,
-                'quality': None
-            })
         
         return message
     
-    def generate_welding_message(self, machine_id: str) -> Dict[str, Any]:
+    def generate_welding_message(self, machine_id: str, timestamp: Optional[str] = None,
+                             status: Optional[str] = None) -> Dict[str, Any]:
         """Generate welding station telemetry message."""
-        config = self.message_types['welding']
+        if timestamp is None:
+            timestamp = self._format_timestamp()
         state = self.machine_states[machine_id]
+        config = state['config']
         
-        # Update status
-        status = self._weighted_choice(config['status_distribution'])
+        # Update status (drawn in bulk per type when numpy is available)
+        if status is None:
+            status = config['_pick_status']()
         state['status'] = status
         
         message = {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'timestamp': timestamp,
             'machine_id': machine_id,
-            'station_id': self._get_station_id('welding', int(machine_id.split('-')[1])),
+            'station_id': state['station_id'],
             'status': status
         }
         
         # Generate assembly info
         if status == 'running':
             state['assembly_count'] += 1
-            assembly_type = random.choice(config['assembly_types'])
+            assembly_type = _choice(config['assembly_types'])
             assembly_id = f"A-{state['assembly_count']}"
-            cycle_time = random.uniform(*config['cycle_time_range'])
-            quality = self._weighted_choice(config['quality_distribution'])
+            cycle_time = _uniform(*config['cycle_time_range'])
+            quality = config['_pick_quality']()
             
             message.update({
                 'assembly_id': assembly_id,
@@ -249,30 +407,29 @@ class FactoryMessageGenerator:
                 'last_cycle_time': round(cycle_time, 1),
                 'quality': quality
             })
-        else:
-            # Show last completed assembly when idle
-            message.update({
-                'assembly_id': f"A-{state['assembly_count']}" if state['assembly_count'] > 0 else None,
-                'assembly_type': None,
-                'last_cycle_time': None,
-                'quality': None
-            })
+        elif state['assembly_count'] > 0:
+            # Reference the last completed assembly when idle
+            message['assembly_id'] = f"A-{state['assembly_count']}"
         
         return message
     
-    def generate_painting_message(self, machine_id: str) -> Dict[str, Any]:
+    def generate_painting_message(self, machine_id: str, timestamp: Optional[str] = None,
+                             status: Optional[str] = None) -> Dict[str, Any]:
         """Generate painting booth telemetry message."""
-        config = self.message_types['painting']
+        if timestamp is None:
+            timestamp = self._format_timestamp()
         state = self.machine_states[machine_id]
+        config = state['config']
         
-        # Update status
-        status = self._weighted_choice(config['status_distribution'])
+        # Update status (drawn in bulk per type when numpy is available)
+        if status is None:
+            status = config['_pick_status']()
         state['status'] = status
         
         message = {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'timestamp': timestamp,
             'machine_id': machine_id,
-            'station_id': self._get_station_id('painting', int(machine_id.split('-')[1])),
+            'station_id': state['station_id'],
             'status': status
         }
         
@@ -280,9 +437,9 @@ class FactoryMessageGenerator:
         if status == 'running':
             state['part_count'] += 1
             part_id = f"Frame-{state['part_count']}"
-            color = random.choice(config['colors'])
-            cycle_time = random.uniform(*config['cycle_time_range'])
-            quality = self._weighted_choice(config['quality_distribution'])
+            color = _choice(config['colors'])
+            cycle_time = _uniform(*config['cycle_time_range'])
+            quality = config['_pick_quality']()
             
             message.update({
                 'part_id': part_id,
@@ -290,46 +447,43 @@ class FactoryMessageGenerator:
                 'cycle_time': round(cycle_time, 1),
                 'quality': quality
             })
-        else:
-            message.update({
-                'part_id': None,
-                'color': None,
-                'cycle_time': None,
-                'quality': None
-            })
         
         return message
     
-    def generate_testing_message(self, machine_id: str) -> Dict[str, Any]:
+    def generate_testing_message(self, machine_id: str, timestamp: Optional[str] = None,
+                             status: Optional[str] = None) -> Dict[str, Any]:
         """Generate testing rig telemetry message."""
-        config = self.message_types['testing']
+        if timestamp is None:
+            timestamp = self._format_timestamp()
         state = self.machine_states[machine_id]
+        config = state['config']
         
-        # Update status
-        status = self._weighted_choice(config['status_distribution'])
+        # Update status (drawn in bulk per type when numpy is available)
+        if status is None:
+            status = config['_pick_status']()
         state['status'] = status
         
         message = {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'timestamp': timestamp,
             'machine_id': machine_id,
-            'station_id': self._get_station_id('testing', int(machine_id.split('-')[1])),
+            'station_id': state['station_id'],
             'status': status
         }
         
         # Generate test results
         if status == 'testing':
             state['test_count'] += 1
-            target_type = random.choice(config['target_types'])
+            target_type = _choice(config['target_types'])
             
             if target_type == 'FullSpaceship':
                 target_id = f"Spaceship-{state['test_count']}"
             else:
                 target_id = f"{target_type}-{state['test_count']}"
             
-            test_result = self._weighted_choice(config['test_distribution'])
+            test_result = config['_pick_test']()
             issues_found = 0
             if test_result == 'fail':
-                issues_found = random.randint(*config['issues_range'])
+                issues_found = _randint(*config['issues_range'])
             
             message.update({
                 'target_id': target_id,
@@ -337,18 +491,13 @@ class FactoryMessageGenerator:
                 'test_result': test_result,
                 'issues_found': issues_found
             })
-        else:
-            message.update({
-                'target_id': None,
-                'target_type': None,
-                'test_result': None,
-                'issues_found': 0
-            })
         
         return message
     
-    def generate_customer_order(self) -> Optional[Dict[str, Any]]:
+    def generate_customer_order(self, timestamp: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Generate customer order event."""
+        if timestamp is None:
+            timestamp = self._format_timestamp()
         config = self.message_types['customer_order']
         
         # Check if we should generate an order based on hourly rate
@@ -356,20 +505,20 @@ class FactoryMessageGenerator:
         base_interval = self.global_config.get('base_interval', 1.0)
         probability = (orders_per_hour / 3600.0) * base_interval
         
-        if random.random() > probability:
+        if _rand() > probability:
             return None
         
         self.order_counter += 1
         order_id = f"ORD-{self.order_counter:04d}"
         
         # Generate order items
-        num_items = random.randint(1, 3)
+        num_items = _randint(1, 3)
         items = []
         
         for _ in range(num_items):
-            product_type = random.choice(config['product_types'])
-            quantity_range = config['quantity_ranges'].get(product_type, [1, 1])
-            quantity = random.randint(*quantity_range)
+            product_type = _choice(config['_order_products'])
+            lo, hi = config['_order_qty'][product_type]
+            quantity = _randint(lo, hi)
             
             items.append({
                 'product_type': product_type,
@@ -380,14 +529,16 @@ class FactoryMessageGenerator:
         self.pending_orders.append(order_id)
         
         return {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'timestamp': timestamp,
             'event_type': 'order_placed',
             'order_id': order_id,
             'items': items
         }
     
-    def generate_dispatch(self) -> Optional[Dict[str, Any]]:
+    def generate_dispatch(self, timestamp: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Generate dispatch event."""
+        if timestamp is None:
+            timestamp = self._format_timestamp()
         config = self.message_types['dispatch']
         
         # Check if we have pending orders
@@ -399,62 +550,100 @@ class FactoryMessageGenerator:
         base_interval = self.global_config.get('base_interval', 1.0)
         probability = (dispatches_per_hour / 3600.0) * base_interval
         
-        if random.random() > probability:
+        if _rand() > probability:
             return None
         
-        # Dispatch the oldest order
-        order_id = self.pending_orders.pop(0)
+        # Dispatch the oldest order (O(1) on a deque, unlike list.pop(0))
+        order_id = self.pending_orders.popleft()
         
         return {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'timestamp': timestamp,
             'event_type': 'order_dispatched',
             'order_id': order_id,
-            'destination': random.choice(config['destinations']),
-            'carrier': random.choice(config['carriers'])
+            'destination': _choice(config['destinations']),
+            'carrier': _choice(config['carriers'])
         }
     
     def generate_messages(self) -> List[Dict[str, Any]]:
         """Generate all messages for the current interval."""
         messages = []
-        
-        # Generate machine telemetry
-        for machine_id, state in self.machine_states.items():
-            machine_type = state['type']
-            
-            if not self.message_types.get(machine_type, {}).get('enabled', False):
-                continue
-            
-            # Check frequency weight to determine if we generate a message
-            frequency_weight = self.message_types[machine_type].get('frequency_weight', 1)
-            if random.random() > (frequency_weight / 10.0):
-                continue
-            
-            # Generate appropriate message type
-            if machine_type == 'cnc_machine':
-                messages.append(self.generate_cnc_message(machine_id))
-            elif machine_type == 'printer_3d':
-                messages.append(self.generate_3d_printer_message(machine_id))
-            elif machine_type == 'welding':
-                messages.append(self.generate_welding_message(machine_id))
-            elif machine_type == 'painting':
-                messages.append(self.generate_painting_message(machine_id))
-            elif machine_type == 'testing':
-                messages.append(self.generate_testing_message(machine_id))
+
+        # All messages in a tick share one timestamp; building it per
+        # message just repeats the same format work
+        timestamp = self._format_timestamp()
+        
+        # Decide which machines report this tick. With numpy the Bernoulli
+        # draws for all machines happen in a single C-level vector op.
+        if np is not None:
+            active = np.random.random(len(self._machine_ids)) < self._freq_thresholds
+            active_ids = [m for m, hit in zip(self._machine_ids, active) if hit]
+        else:
+            active_ids = [m for m, threshold in zip(self._machine_ids, self._freq_thresholds)
+                          if _rand() < threshold]
+
+        # Generate machine telemetry (disabled types were filtered at init).
+        # With numpy, machines are grouped by type and their statuses drawn
+        # in one rng.choice per distribution, executed in C; each generator
+        # then receives its pre-drawn status.
+        generators = self._generators
+        if self._rng is not None:
+            by_type: Dict[str, List[str]] = {}
+            for machine_id in active_ids:
+                by_type.setdefault(self.machine_states[machine_id]['type'], []).append(machine_id)
+            for machine_type, group in by_type.items():
+                generator = generators.get(machine_type)
+                if generator is None:
+                    continue
+                type_config = self.message_types.get(machine_type, {})
+                values = type_config.get('_status_values')
+                if values is not None:
+                    indexes = self._rng.choice(len(values), size=len(group),
+                                               p=type_config['_status_probs'])
+                    for machine_id, index in zip(group, indexes):
+                        messages.append(generator(machine_id, timestamp, values[index]))
+                else:
+                    for machine_id in group:
+                        messages.append(generator(machine_id, timestamp))
+        else:
+            for machine_id in active_ids:
+                generator = generators.get(self.machine_states[machine_id]['type'])
+                if generator is not None:
+                    messages.append(generator(machine_id, timestamp))
         
         # Generate customer order (if applicable)
         if self.message_types.get('customer_order', {}).get('enabled', False):
-            order_msg = self.generate_customer_order()
+            order_msg = self.generate_customer_order(timestamp)
             if order_msg:
                 messages.append(order_msg)
         
         # Generate dispatch event (if applicable)
         if self.message_types.get('dispatch', {}).get('enabled', False):
-            dispatch_msg = self.generate_dispatch()
+            dispatch_msg = self.generate_dispatch(timestamp)
             if dispatch_msg:
                 messages.append(dispatch_msg)
         
         return messages
-    
+
+    def generate_batch(self, n_ticks: int) -> List[Dict[str, Any]]:
+        """Generate several ticks' worth of messages as one flat list.
+
+        Handing the whole batch to the publisher at once lets it amortize
+        its fixed per-call overhead instead of paying it every tick.
+        """
+        messages: List[Dict[str, Any]] = []
+        for _ in range(n_ticks):
+            messages.extend(self.generate_messages())
+        return messages
+
+    def generate_serialized(self) -> List[bytes]:
+        """Generate one tick of messages pre-serialized to JSON bytes.
+
+        Serializing at the source means publishers can hand the same
+        payload bytes straight to the MQTT client (and reuse them across
+        subscribers) without a per-publish encode step.
+        """
+        return [serialize_message(message) for message in self.generate_messages()]
+
     def get_base_interval(self) -> float:
         """Get the base interval for message generation."""
         return self.global_config.get('base_interval', 1.0)
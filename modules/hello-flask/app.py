@@ -1,21 +1,35 @@
-from flask import Flask, jsonify
+from flask import Flask, Response
 from datetime import datetime
+import json
 import os
 
 app = Flask(__name__)
 
+# Everything except the timestamp is fixed for the life of the process, so
+# the responses are prebuilt at import: /health serves one shared Response
+# and / only appends the timestamp to cached prefix bytes instead of
+# marshaling a dict through jsonify per request.
+HOSTNAME = os.environ.get('HOSTNAME', 'unknown')
+
+_HELLO_PREFIX = (
+    b'{"message":"Hello from IoT Edge!","hostname":'
+    + json.dumps(HOSTNAME).encode('utf-8')
+    + b',"version":"1.0.0","timestamp":"'
+)
+
+_HEALTH = Response(b'{"status":"healthy"}', status=200, mimetype='application/json')
+
+
 @app.route('/')
 def hello():
-    return jsonify({
-        'message': 'Hello from IoT Edge!',
-        'timestamp': datetime.utcnow().isoformat(),
-        'hostname': os.environ.get('HOSTNAME', 'unknown'),
-        'version': '1.0.0'
-    })
+    body = _HELLO_PREFIX + datetime.utcnow().isoformat().encode('ascii') + b'"}'
+    return Response(body, mimetype='application/json')
+
 
 @app.route('/health')
 def health():
-    return jsonify({'status': 'healthy'}), 200
+    return _HEALTH
+
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)